@@ -1,14 +1,15 @@
 import streamlit as st
 import pandas as pd
-import math
-import random
+import numpy as np
 import plotly.graph_objects as go
 import glob
 import os
-import base64
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
 # 1. 再現性のためランダムシードを固定
-random.seed(42)
+RANDOM_SEED = 42
+_RNG = np.random.default_rng(RANDOM_SEED)
 
 # --- 定数定義 ---
 # 設定値を関数の外に出し、可読性とメンテナンス性を向上
@@ -29,70 +30,66 @@ SYMBOL_MAP = {
     "チェンジ": "triangle-up", "フォーク": "x", "不明": "cross", "カット": "triangle-right",
     "シュート": "triangle-left",
 }
+# グラフとサマリーで使う列 (これ以外の列はフィルター後に持ち回さない)
+PLOT_COLS = [
+    '打球X', '打球Y', '_color', '_symbol',
+    'HitType', 'PitchType', 'Batter', 'Memo', 'Ball', 'Strike',
+]
 
-# 2. 背景画像をbase64エンコード
-@st.cache_data
-def load_background_image(image_path):
-    with open(image_path, "rb") as f:
-        image_bytes = f.read()
-    encoded_image = base64.b64encode(image_bytes).decode()
-    return f"data:image/png;base64,{encoded_image}"
-
-# 3. MemoをXY座標に変換
+# 2. MemoをXY座標に変換 (Memo列全体をまとめてベクトル演算で処理)
 def parse_memo_to_xy_random_fixed(memo, angle_range=0.05, distance_range=0.1):
-    if isinstance(memo, str) and len(memo) >= 2:
-        direction = memo[0].upper()
-        try:
-            distance_rank = int(memo[1])
-        except (ValueError, IndexError):
-            return pd.Series([None, None])
+    memo = memo.astype('string')
+    angle_center = memo.str[0].str.upper().map(DIRECTION_TO_ANGLE)
+    # 距離ランクはint()と同様に全角などUnicodeの数字も受け付ける (種類の少ない文字ごとに変換)
+    rank_char = memo.str[1]
+    char_to_rank = {c: unicodedata.decimal(c, None) for c in rank_char.dropna().unique()}
+    base_distance = rank_char.map(char_to_rank).map(RANK_TO_DISTANCE)
 
-        angle_center = DIRECTION_TO_ANGLE.get(direction)
-        base_distance = RANK_TO_DISTANCE.get(distance_rank)
+    # 変換できないMemoはNaNのまま伝播させる
+    angle_center = angle_center.to_numpy(dtype=float, na_value=np.nan)
+    base_distance = base_distance.to_numpy(dtype=float, na_value=np.nan)
 
-        if angle_center is None or base_distance is None:
-            return pd.Series([None, None])
+    n = len(memo)
+    angle_deg = angle_center + _RNG.uniform(-angle_range, angle_range, n)
+    distance = base_distance * _RNG.uniform(1 - distance_range, 1 + distance_range, n)
+    angle_rad = np.radians(angle_deg)
 
-        angle_deg = angle_center + random.uniform(-angle_range, angle_range)
-        distance = base_distance * random.uniform(1 - distance_range, 1 + distance_range)
-        angle_rad = math.radians(angle_deg)
-        
-        a_scale = 1.2
-        b_scale = 0.8
-        x = round(distance * a_scale * math.sin(angle_rad), 2)
-        y = round(distance * b_scale * math.cos(angle_rad), 2)
-        return pd.Series([x, y])
-    else:
-        return pd.Series([None, None])
+    a_scale = 1.2
+    b_scale = 0.8
+    # 描画用の座標なのでfloat32で十分 (plotly>=6はnumpy配列をそのまま型付き配列で送るため転送量も半減)
+    x = np.round(distance * a_scale * np.sin(angle_rad), 2).astype('float32')
+    y = np.round(distance * b_scale * np.cos(angle_rad), 2).astype('float32')
+    return pd.DataFrame({'打球X': x, '打球Y': y}, index=memo.index)
 
-# 4. 色・マーカー設定関数
-def get_color_by_hittype(hittype):
-    return COLOR_MAP.get(hittype, "gray")
+# 3. データ読み込みと前処理
+def read_game_csv(file):
+    # PyArrowエンジンで並列パースし、Arrow型の列として読み込む
+    df = pd.read_csv(file, encoding='utf-8', engine='pyarrow', dtype_backend='pyarrow')
+    df["試合"] = os.path.basename(file)
+    return df
 
-def get_symbol_by_pitchtype(pitchtype):
-    return SYMBOL_MAP.get(pitchtype, "circle")
-
-# 5. データ読み込みと前処理
-@st.cache_data
-def load_and_preprocess_data(folder_path):
-    csv_files = glob.glob(os.path.join(folder_path, "*.csv"))
-    if not csv_files:
+# file_sigsは(パス, 更新時刻)のタプル。CSVが変わるとキャッシュが無効になる
+@st.cache_data(persist="disk", show_spinner=False)
+def load_and_preprocess_data(file_sigs):
+    if not file_sigs:
         return pd.DataFrame()
 
+    # 複数のCSVをスレッドプールで同時に読み込む (警告表示はメインスレッドで行う)
+    with ThreadPoolExecutor(max_workers=min(8, len(file_sigs))) as executor:
+        futures = {executor.submit(read_game_csv, file): file for file, _ in file_sigs}
+
     df_list = []
-    for file in csv_files:
+    for future, file in futures.items():
         try:
-            df = pd.read_csv(file, encoding='utf-8') # or 'cp932'
-            df["試合"] = os.path.basename(file)
-            df_list.append(df)
+            df_list.append(future.result())
         except Exception as e:
             st.warning(f"ファイル {file} の読み込み中にエラーが発生しました: {e}")
-            
+
     if not df_list:
         return pd.DataFrame()
 
     df_all = pd.concat(df_list, ignore_index=True)
-    df_all[['打球X', '打球Y']] = df_all['Memo'].apply(parse_memo_to_xy_random_fixed)
+    df_all[['打球X', '打球Y']] = parse_memo_to_xy_random_fixed(df_all['Memo'])
     
     # 解析に必要なカラムが存在するか確認
     required_cols = ['Batter', 'PitchType', 'HitType', 'Memo']
@@ -101,42 +98,136 @@ def load_and_preprocess_data(folder_path):
         return pd.DataFrame()
         
     df_all = df_all.dropna(subset=['打球X', '打球Y'])
+
+    # 色・マーカーは行ごとに固定なので、読み込み時に一度だけ割り当てる
+    df_all['_color'] = df_all['HitType'].map(COLOR_MAP).fillna('gray').astype('category')
+    df_all['_symbol'] = df_all['PitchType'].map(SYMBOL_MAP).fillna('circle').astype('category')
+
+    # カウントは読み込み時に一度だけ小さい整数型へ変換する
+    for col in ('Ball', 'Strike'):
+        if col in df_all.columns:
+            df_all[col] = pd.to_numeric(df_all[col], errors='coerce').astype('Int8')
+
+    # フィルターで使う列はカテゴリ型にして比較を高速化
+    for col in ('Batter', '試合', 'HitType', 'PitchType'):
+        df_all[col] = df_all[col].astype('category')
     return df_all
 
-# 6. Streamlit アプリ本体
+# 4. フィルターの選択肢 (df_allが変わらない限り一度だけ集計する)
+@st.cache_data
+def get_filter_options(_df_all, file_sigs):
+    options = {
+        col: sorted(_df_all[col].dropna().unique())
+        for col in ('Batter', '試合', 'HitType')
+    }
+    for col in ('Ball', 'Strike'):
+        if col in _df_all.columns:
+            options[col] = sorted(_df_all[col].dropna().unique().astype(int))
+    return options
+
+# 5. データフィルタリング (同じ条件の組み合わせはキャッシュから返す)
+# df_allはハッシュ対象から外し、代わりにfile_sigsでデータの同一性を判定する
+@st.cache_data(max_entries=128)
+def filter_df(_df_all, file_sigs, batter, game, hit_types, pitch_filter, ball, strike):
+    # 条件ごとに絞り込まず、1つのマスクにまとめてから一度だけ抽出する
+    mask = np.ones(len(_df_all), dtype=bool)
+    if batter != "全選手":
+        mask &= (_df_all['Batter'] == batter).to_numpy()
+    if game != "全試合":
+        mask &= (_df_all['試合'] == game).to_numpy()
+    if hit_types:
+        mask &= _df_all['HitType'].isin(hit_types).to_numpy()
+
+    if pitch_filter == "ストレート":
+        mask &= (_df_all['PitchType'] == "ストレート").to_numpy()
+    elif pitch_filter == "変化球":
+        mask &= ~_df_all['PitchType'].isin(["ストレート", "不明"]).to_numpy()
+
+    # カウントによる絞り込み (欠損値は一致しない扱い)
+    if ball is not None and ball != "すべて":
+        mask &= (_df_all['Ball'] == ball).to_numpy(dtype=bool, na_value=False)
+    if strike is not None and strike != "すべて":
+        mask &= (_df_all['Strike'] == strike).to_numpy(dtype=bool, na_value=False)
+    plot_cols = [col for col in PLOT_COLS if col in _df_all.columns]
+    return _df_all.loc[mask, plot_cols]
+
+# 6. データサマリー (フィルター条件をキーにキャッシュし、DataFrameはハッシュしない)
+@st.cache_data(max_entries=128)
+def summarize(_df_filtered, filter_key):
+    hit_summary = (
+        _df_filtered['HitType'].cat.remove_unused_categories()
+        .value_counts().rename_axis('種類').reset_index(name='球数')
+    )
+    pitch_summary = (
+        _df_filtered['PitchType'].cat.remove_unused_categories()
+        .value_counts().rename_axis('球種').reset_index(name='球数')
+    )
+    return hit_summary, pitch_summary
+
+# 7. グラフのレイアウト (データに依存しないので一度だけ作成して使い回す)
+@st.cache_resource
+def build_layout(image_source):
+    return dict(
+        xaxis=dict(range=[-200, 200], showgrid=False, zeroline=False, showticklabels=False, title=None),
+        yaxis=dict(range=[-20, 240], showgrid=False, zeroline=False, showticklabels=False, title=None),
+        width=800, height=700,
+        plot_bgcolor="white",
+        margin=dict(l=20, r=20, t=40, b=20),
+        images=[dict(
+            source=image_source,
+            xref="x", yref="y",
+            x=-292.5, y=296.25,
+            sizex=585, sizey=315,
+            sizing="stretch",
+            opacity=1,
+            layer="below"
+        )]
+    )
+
+# 8. 該当データがないときの空のグラフ (背景画像だけを表示)
+@st.cache_resource
+def empty_fig(image_source):
+    fig = go.Figure()
+    fig.update_layout(**build_layout(image_source))
+    return fig
+
+# 9. Streamlit アプリ本体
 def main():
     st.set_page_config(layout="wide")
     st.title("打球方向可視化アプリ")
 
     # --- パス設定 ---
-    image_path = "打球分析.png"
+    # 背景画像はStreamlitの静的ファイル配信 (.streamlit/config.toml) でURLとして参照する
+    image_path = os.path.join("static", "打球分析.png")
+    image_source = "app/static/打球分析.png"
     folder_path = "試合データ"
 
     if not os.path.exists(image_path) or not os.path.exists(folder_path):
-        st.error("背景画像 `打球分析.png` または `試合データ` フォルダが見つかりません。")
+        st.error("背景画像 `static/打球分析.png` または `試合データ` フォルダが見つかりません。")
         return
 
     # --- データ読み込み ---
-    df_all = load_and_preprocess_data(folder_path)
+    csv_files = sorted(glob.glob(os.path.join(folder_path, "*.csv")))
+    file_sigs = tuple((path, os.path.getmtime(path)) for path in csv_files)
+    df_all = load_and_preprocess_data(file_sigs)
     if df_all.empty:
         st.error("表示できるデータがありません。`試合データ` フォルダにCSVファイルを確認してください。")
         return
 
-    image_source = load_background_image(image_path)
-    
     # --- サイドバー (フィルター) ---
     st.sidebar.header("フィルター設定")
+    filter_options = get_filter_options(df_all, file_sigs)
 
     # 打者選択
-    batters = ["全選手"] + sorted(df_all['Batter'].dropna().unique())
+    batters = ["全選手"] + filter_options['Batter']
     selected_batter = st.sidebar.selectbox("打者を選択", options=batters)
 
     # 試合選択
-    games = ["全試合"] + sorted(df_all['試合'].dropna().unique())
+    games = ["全試合"] + filter_options['試合']
     selected_game = st.sidebar.selectbox("試合を選択", options=games)
 
     # 打球種類フィルター
-    hit_types = sorted(df_all['HitType'].dropna().unique())
+    hit_types = filter_options['HitType']
     selected_hit_types = st.sidebar.multiselect("打球種類", options=hit_types, default=hit_types)
     
     # 球種フィルター
@@ -144,35 +235,26 @@ def main():
     
     # ★★★ 新機能: カウントフィルター ★★★
     selected_ball, selected_strike = None, None
-    if 'Ball' in df_all.columns and 'Strike' in df_all.columns:
+    if 'Ball' in filter_options and 'Strike' in filter_options:
         st.sidebar.subheader("カウントフィルター")
-        ball_options = ["すべて"] + sorted(df_all['Ball'].dropna().unique().astype(int))
+        ball_options = ["すべて"] + filter_options['Ball']
         selected_ball = st.sidebar.selectbox("ボールカウント", options=ball_options)
 
-        strike_options = ["すべて"] + sorted(df_all['Strike'].dropna().unique().astype(int))
+        strike_options = ["すべて"] + filter_options['Strike']
         selected_strike = st.sidebar.selectbox("ストライクカウント", options=strike_options)
     else:
         st.sidebar.warning("CSVに 'Ball'/'Strike' カラムがないため、カウントフィルターは無効です。")
 
     # --- データフィルタリング ---
-    df_filtered = df_all.copy()
-    if selected_batter != "全選手":
-        df_filtered = df_filtered[df_filtered['Batter'] == selected_batter]
-    if selected_game != "全試合":
-        df_filtered = df_filtered[df_filtered['試合'] == selected_game]
-    if selected_hit_types:
-        df_filtered = df_filtered[df_filtered['HitType'].isin(selected_hit_types)]
-    
-    if pitch_filter == "ストレート":
-        df_filtered = df_filtered[df_filtered['PitchType'] == "ストレート"]
-    elif pitch_filter == "変化球":
-        df_filtered = df_filtered[~df_filtered['PitchType'].isin(["ストレート", "不明"])]
-    
-    # ★★★ 新機能: カウントによる絞り込み ★★★
-    if selected_ball is not None and selected_ball != "すべて":
-        df_filtered = df_filtered[df_filtered['Ball'] == selected_ball]
-    if selected_strike is not None and selected_strike != "すべて":
-        df_filtered = df_filtered[df_filtered['Strike'] == selected_strike]
+    filter_key = (
+        file_sigs, selected_batter, selected_game, tuple(selected_hit_types),
+        pitch_filter, selected_ball, selected_strike,
+    )
+    df_filtered = filter_df(df_all, *filter_key)
+    if df_filtered.empty:
+        st.info("条件に該当するデータがありません。")
+        st.plotly_chart(empty_fig(image_source), use_container_width=True)
+        return
 
     # --- メインコンテンツ ---
     col1, col2 = st.columns([3, 1])
@@ -196,55 +278,48 @@ def main():
 
         # --- グラフ作成 ---
         fig = go.Figure()
-        
-        fig.add_trace(go.Scatter(
+
+        # ホバーテキストも列単位の文字列連結で作成
+        # 欠損値があると連結結果全体がNaNになるため、空文字に置き換えてから連結する
+        text = {
+            col: df_filtered[col].astype(object).fillna('').astype(str)
+            for col in ('Batter', 'HitType', 'PitchType', 'Ball', 'Strike', 'Memo')
+        }
+        hover_text = (
+            '選手: ' + text['Batter']
+            + '<br>打球: ' + text['HitType']
+            + '<br>球種: ' + text['PitchType']
+            + '<br>カウント: ' + text['Ball'] + '-' + text['Strike']
+            + '<br>メモ: ' + text['Memo']
+        )
+
+        fig.add_trace(go.Scattergl(
             x=df_filtered['打球X'],
             y=df_filtered['打球Y'],
             mode="markers",
             marker=dict(
                 size=10,
-                color=[get_color_by_hittype(ht) for ht in df_filtered['HitType']],
-                symbol=[get_symbol_by_pitchtype(pt) for pt in df_filtered['PitchType']],
+                color=df_filtered['_color'].to_numpy(),
+                symbol=df_filtered['_symbol'].to_numpy(),
                 line=dict(width=1, color='DarkSlateGrey')
             ),
-            text=[f"選手: {b}<br>打球: {h}<br>球種: {p}<br>カウント: {int(ba)}-{int(s)}<br>メモ: {m}" 
-                  for b, h, p, m, ba, s in zip(df_filtered['Batter'], df_filtered['HitType'], df_filtered['PitchType'], df_filtered['Memo'], df_filtered['Ball'], df_filtered['Strike'])],
+            text=hover_text.to_numpy(),
             hoverinfo='text',
             name=selected_batter,
         ))
 
-        fig.update_layout(
-            xaxis=dict(range=[-200, 200], showgrid=False, zeroline=False, showticklabels=False, title=None),
-            yaxis=dict(range=[-20, 240], showgrid=False, zeroline=False, showticklabels=False, title=None),
-            width=800, height=700,
-            plot_bgcolor="white",
-            margin=dict(l=20, r=20, t=40, b=20),
-            images=[dict(
-                source=image_source,
-                xref="x", yref="y",
-                x=-292.5, y=296.25,
-                sizex=585, sizey=315,
-                sizing="stretch",
-                opacity=1,
-                layer="below"
-            )]
-        )
+        fig.update_layout(**build_layout(image_source))
         st.plotly_chart(fig, use_container_width=True)
 
     with col2:
         st.subheader("データサマリー")
-        if not df_filtered.empty:
-            st.write("#### 打球種類")
-            hit_summary = df_filtered['HitType'].value_counts().reset_index()
-            hit_summary.columns = ['種類', '球数']
-            st.dataframe(hit_summary, use_container_width=True)
-            
-            st.write("#### 打った球種")
-            pitch_summary = df_filtered['PitchType'].value_counts().reset_index()
-            pitch_summary.columns = ['球種', '球数']
-            st.dataframe(pitch_summary, use_container_width=True)
-        else:
-            st.info("表示するデータがありません。")
+        hit_summary, pitch_summary = summarize(df_filtered, filter_key)
+
+        st.write("#### 打球種類")
+        st.dataframe(hit_summary, use_container_width=True)
+
+        st.write("#### 打った球種")
+        st.dataframe(pitch_summary, use_container_width=True)
 
 if __name__ == "__main__":
     main()